@@ -5,12 +5,18 @@ Run in background: screen -dmS discord_watcher python discord_sonar_watcher.py
 """
 
 import sqlite3
+import threading
 import time
 import logging
 import os
+import select
+import orjson
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -18,10 +24,13 @@ load_dotenv()
 # ─── Config ───────────────────────────────────────────────────────────────────
 DB_PATH         = Path(__file__).parent / "insider.db"
 DISCORD_WEBHOOK = os.getenv("DISCORD_WEBHOOK_URL", "")
-CHECK_INTERVAL  = 15       # seconds between DB polls
+CHECK_INTERVAL  = 15       # seconds between DB polls when no tick arrives
+TICK_PATH       = Path(__file__).parent / ".insider_tick"   # sonar_insider writes here on new alerts
 MIN_SCORE       = 3.0      # minimum score to trigger alert
 MIN_USD         = 500      # minimum USD value to alert on
 WHALE_USD       = 10_000   # USD threshold for whale alert
+COALESCE_SECS   = 2.0      # batch alerts arriving within this window into one message
+MAX_EMBEDS      = 10       # Discord's per-message embed limit
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,17 +39,88 @@ logging.basicConfig(
 )
 log = logging.getLogger("discord_watcher")
 
+# ─── DB ───────────────────────────────────────────────────────────────────────
+# WAL is enabled by sonar_insider.init_db(); these are per-connection settings
+PRAGMAS = ("PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000", "PRAGMA temp_store=MEMORY",
+           "PRAGMA cache_size=-20000", "PRAGMA mmap_size=268435456")
+
+# is_alert (score >= 3.0 AND usd_value >= 500) is maintained by sonar_insider's schema;
+# MIN_SCORE / MIN_USD can only tighten it
+_POLL_SQL = """
+    SELECT * FROM trades INDEXED BY idx_trades_alerts
+    WHERE id > ?
+      AND is_alert = 1
+      AND score >= ?
+      AND usd_value >= ?
+    ORDER BY id ASC
+"""
+_DIGEST_SQL = """
+    SELECT COALESCE(SUM(usd_value), 0), COUNT(*),
+           COALESCE(SUM(CASE WHEN usd_value >= ? THEN 1 ELSE 0 END), 0)
+    FROM trades WHERE timestamp >= ?
+"""
+_TOP_MARKETS_SQL = """
+    SELECT market_name, SUM(usd_value) as vol
+    FROM trades WHERE timestamp >= ?
+    GROUP BY market_name ORDER BY vol DESC LIMIT 3
+"""
+_MAX_ID_SQL = "SELECT MAX(id) FROM trades"
+
+_local = threading.local()   # one long-lived connection per thread
+
+def get_con() -> sqlite3.Connection:
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, cached_statements=256)
+        con.row_factory = sqlite3.Row
+        for p in PRAGMAS:
+            con.execute(p)
+        _local.con = con
+    return con
+
+# ─── HTTP ─────────────────────────────────────────────────────────────────────
+# Keep-alive session: one TLS handshake for all webhooks; 429/5xx retried with backoff
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=None, respect_retry_after_header=True),   # None: retry POST too
+))
+
+def respect_rate_limit(resp: requests.Response):
+    """Sleep out the bucket reset when Discord says this was our last request in it."""
+    if resp.headers.get("X-RateLimit-Remaining") == "0":
+        time.sleep(float(resp.headers.get("X-RateLimit-Reset-After", 0)))
+
+# Alerts are posted from worker threads so a slow webhook doesn't hold up the next poll
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
 # ─── State ────────────────────────────────────────────────────────────────────
 last_seen_id = 0   # track last alerted trade ID to avoid duplicates
 
 # ─── Discord Payload Builder ──────────────────────────────────────────────────
-def build_embed(trade: dict) -> dict:
+# Pre-serialized embed: only the per-trade values are %-formatted in, so the hot path
+# skips building and json-encoding a nested dict. Free-text values go through quote().
+EMBED_TMPL = (
+    '{"title":%s,"description":%s,"color":%d,"fields":['
+    '{"name":"💰 USD Value","value":"`$%s`","inline":true},'
+    '{"name":"📈 Price","value":"`%.4f`","inline":true},'
+    '{"name":"📊 Score","value":"`%.1f / 5.0`","inline":true},'
+    '{"name":"🔍 Signal","value":%s,"inline":false},'
+    '{"name":"⏰ Time (UTC)","value":"`%s`","inline":true},'
+    '{"name":"🎯 Outcome","value":%s,"inline":true}],'
+    '"footer":{"text":"PolyInsider Terminal • polymarket.com"},"timestamp":"%s"}'
+)
+PAYLOAD_TMPL = '{"embeds":[%s]}'
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+def quote(text: str) -> str:
+    return orjson.dumps(text).decode()
+
+def build_embed(trade: sqlite3.Row) -> str:
     usd   = trade["usd_value"]
-    price = trade["price"]
     score = trade["score"]
-    mkt   = trade["market_name"][:80]
-    alert = trade["alert"]
-    ts    = trade["timestamp"]
+    ts    = datetime.fromtimestamp(trade["timestamp"] / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
     if usd >= WHALE_USD:
         color  = 0xFF3333   # red — whale
@@ -52,57 +132,56 @@ def build_embed(trade: dict) -> dict:
         color  = 0x00AA88
         title  = f"📊 Trade Alert — ${usd:,.0f}"
 
-    return {
-        "embeds": [{
-            "title":       title,
-            "description": f"**{mkt}**",
-            "color":       color,
-            "fields": [
-                {"name": "💰 USD Value",   "value": f"`${usd:,.2f}`",         "inline": True},
-                {"name": "📈 Price",       "value": f"`{price:.4f}`",          "inline": True},
-                {"name": "📊 Score",       "value": f"`{score:.1f} / 5.0`",    "inline": True},
-                {"name": "🔍 Signal",      "value": alert,                     "inline": False},
-                {"name": "⏰ Time (UTC)",  "value": f"`{ts}`",                 "inline": True},
-                {"name": "🎯 Outcome",     "value": f"`{trade['outcome']}`",   "inline": True},
-            ],
-            "footer": {"text": "PolyInsider Terminal • polymarket.com"},
-            "timestamp": datetime.utcnow().isoformat(),
-        }]
-    }
+    return EMBED_TMPL % (
+        quote(title), quote(f"**{trade['market_name'][:80]}**"), color,
+        f"{usd:,.2f}", trade["price"], score, quote(trade["alert"]), ts,
+        quote(f"`{trade['outcome']}`"), datetime.utcnow().isoformat(),
+    )
 
 # ─── Discord Sender ───────────────────────────────────────────────────────────
-def send_discord_alert(trade: dict):
+def send_discord_alerts(trades: list[sqlite3.Row]):
     if not DISCORD_WEBHOOK:
         log.warning("No DISCORD_WEBHOOK_URL set — skipping alert.")
         return
 
-    payload = build_embed(trade)
+    payload = (PAYLOAD_TMPL % ",".join(build_embed(t) for t in trades)).encode()
     try:
-        resp = requests.post(DISCORD_WEBHOOK, json=payload, timeout=10)
+        resp = SESSION.post(DISCORD_WEBHOOK, data=payload, headers=JSON_HEADERS, timeout=10)
+        respect_rate_limit(resp)
         if resp.status_code in (200, 204):
-            log.info(f"✅ Alerted: {trade['market_name'][:40]} | ${trade['usd_value']:,.0f}")
+            for t in trades:
+                log.info(f"✅ Alerted: {t['market_name'][:40]} | ${t['usd_value']:,.0f}")
         else:
             log.warning(f"Discord returned {resp.status_code}: {resp.text[:200]}")
     except requests.RequestException as e:
         log.error(f"Failed to send Discord alert: {e}")
 
+# ─── Alert Coalescing ─────────────────────────────────────────────────────────
+# Alerts arriving within COALESCE_SECS share one webhook call (up to MAX_EMBEDS
+# embeds each) to stay inside Discord's per-channel rate limit during bursts.
+_pending: list[sqlite3.Row] = []
+_pending_lock = threading.Lock()
+
+def queue_alert(trade: sqlite3.Row):
+    with _pending_lock:
+        _pending.append(trade)
+        if len(_pending) == 1:
+            threading.Timer(COALESCE_SECS, flush_alerts).start()
+
+def flush_alerts():
+    with _pending_lock:
+        batch = _pending[:]
+        _pending.clear()
+    for i in range(0, len(batch), MAX_EMBEDS):
+        EXECUTOR.submit(send_discord_alerts, batch[i:i + MAX_EMBEDS])
+
 # ─── DB Poller ────────────────────────────────────────────────────────────────
-def poll_new_trades() -> list[dict]:
+def poll_new_trades() -> list[sqlite3.Row]:
     global last_seen_id
     if not DB_PATH.exists():
         return []
 
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    cur = con.execute("""
-        SELECT * FROM trades
-        WHERE id > ?
-          AND score >= ?
-          AND usd_value >= ?
-        ORDER BY id ASC
-    """, (last_seen_id, MIN_SCORE, MIN_USD))
-    rows = [dict(r) for r in cur.fetchall()]
-    con.close()
+    rows = get_con().execute(_POLL_SQL, (last_seen_id, MIN_SCORE, MIN_USD)).fetchall()
 
     if rows:
         last_seen_id = rows[-1]["id"]
@@ -116,20 +195,12 @@ def send_hourly_digest():
     if not DISCORD_WEBHOOK:
         return
 
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    since = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+    con = get_con()
+    since = int(time.time() * 1000) - 3_600_000
 
-    total_vol  = con.execute("SELECT SUM(usd_value) FROM trades WHERE timestamp >= ?", (since,)).fetchone()[0] or 0
-    trade_cnt  = con.execute("SELECT COUNT(*) FROM trades WHERE timestamp >= ?", (since,)).fetchone()[0] or 0
-    whale_cnt  = con.execute("SELECT COUNT(*) FROM trades WHERE timestamp >= ? AND usd_value >= ?", (since, WHALE_USD)).fetchone()[0] or 0
+    total_vol, trade_cnt, whale_cnt = con.execute(_DIGEST_SQL, (WHALE_USD, since)).fetchone()
 
-    top_markets = con.execute("""
-        SELECT market_name, SUM(usd_value) as vol
-        FROM trades WHERE timestamp >= ?
-        GROUP BY market_name ORDER BY vol DESC LIMIT 3
-    """, (since,)).fetchall()
-    con.close()
+    top_markets = con.execute(_TOP_MARKETS_SQL, (since,)).fetchall()
 
     top_str = "\n".join([f"• {r['market_name'][:50]} — ${r['vol']:,.0f}" for r in top_markets]) or "No data"
 
@@ -147,9 +218,32 @@ def send_hourly_digest():
             "timestamp": datetime.utcnow().isoformat(),
         }]
     }
-    requests.post(DISCORD_WEBHOOK, json=payload, timeout=10)
+    resp = SESSION.post(DISCORD_WEBHOOK, data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=10)
+    respect_rate_limit(resp)
     log.info("📋 Sent hourly digest")
 
+# ─── Wakeups ──────────────────────────────────────────────────────────────────
+def open_tick() -> int | None:
+    """Open the tick FIFO, creating it if needed. None means fall back to plain polling."""
+    try:
+        if not TICK_PATH.exists():
+            os.mkfifo(TICK_PATH)
+        # O_RDWR keeps a writer attached, so select() doesn't spin on EOF between sonar writes
+        return os.open(TICK_PATH, os.O_RDWR | os.O_NONBLOCK)
+    except (OSError, AttributeError):   # AttributeError: no mkfifo on this platform
+        return None
+
+def wait_tick(fd: int | None, timeout: float):
+    if fd is None:
+        time.sleep(timeout)
+        return
+    ready, _, _ = select.select([fd], [], [], timeout)
+    if ready:
+        try:
+            os.read(fd, 4096)   # drain every pending tick; one poll covers them all
+        except BlockingIOError:
+            pass
+
 # ─── Main Loop ────────────────────────────────────────────────────────────────
 def main():
     global last_digest
@@ -161,21 +255,20 @@ def main():
 
     # Seed last_seen_id to current max so we don't re-alert old trades
     if DB_PATH.exists():
-        con = sqlite3.connect(DB_PATH)
-        row = con.execute("SELECT MAX(id) FROM trades").fetchone()
-        con.close()
+        row = get_con().execute(_MAX_ID_SQL).fetchone()
         global last_seen_id
         last_seen_id = row[0] or 0
         log.info(f"Starting from trade ID {last_seen_id}")
 
-    log.info(f"Polling every {CHECK_INTERVAL}s | Min score: {MIN_SCORE} | Min $: {MIN_USD}")
+    tick_fd = open_tick()
+    log.info(f"Polling {'on tick, ' if tick_fd is not None else ''}every {CHECK_INTERVAL}s | Min score: {MIN_SCORE} | Min $: {MIN_USD}")
 
     while True:
         try:
             trades = poll_new_trades()
             for trade in trades:
                 log.info(f"🚨 {trade['alert']} | {trade['market_name'][:40]} | ${trade['usd_value']:,.0f}")
-                send_discord_alert(trade)
+                queue_alert(trade)
 
             # Hourly digest
             if (datetime.utcnow() - last_digest).seconds >= 3600:
@@ -185,7 +278,7 @@ def main():
         except Exception as e:
             log.error(f"Watcher error: {e}")
 
-        time.sleep(CHECK_INTERVAL)
+        wait_tick(tick_fd, CHECK_INTERVAL)
 
 if __name__ == "__main__":
     main()
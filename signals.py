@@ -5,13 +5,19 @@ Detects: repeated buys, sudden odds shifts, price velocity spikes, coordinated e
 """
 
 import sqlite3
+import threading
 import time
 import logging
 import os
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,47 +26,107 @@ DB_PATH   = Path(__file__).parent / "insider.db"
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 CHAT_ID   = os.getenv("TELEGRAM_CHAT_ID", "")
 INTERVAL  = 60   # run signal scan every 60 seconds
+OPTIMIZE_EVERY = 900   # refresh planner stats (PRAGMA optimize) every 15 minutes
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [SIGNAL] %(message)s", datefmt="%H:%M:%S")
 log = logging.getLogger("signals")
 
+# WAL is enabled by sonar_insider.init_db(); these are per-connection settings
+PRAGMAS = ("PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000", "PRAGMA temp_store=MEMORY",
+           "PRAGMA cache_size=-20000", "PRAGMA mmap_size=268435456")
+
+_local = threading.local()   # one long-lived connection per thread
+
+def get_con():
+    con = getattr(_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, cached_statements=256)
+        con.row_factory = sqlite3.Row
+        for p in PRAGMAS: con.execute(p)
+        _local.con = con
+    return con
+
+# ── SQL: module constants, so each statement is prepared once per connection ──
+_ACCUM_SQL = """
+    SELECT market_name, outcome, COUNT(*) as cnt, SUM(usd_value) as total,
+           AVG(price) as avg_price, MAX(price) as max_price, MIN(price) as min_price
+    FROM trades
+    WHERE timestamp >= ? AND side = 'BUY' AND usd_value >= 200
+    GROUP BY market_name, outcome
+    HAVING cnt >= 3
+    ORDER BY total DESC
+"""
+_VELOCITY_SQL = """
+    SELECT market_name,
+           AVG(CASE WHEN timestamp >= :s15 THEN price END) as r_p,
+           AVG(CASE WHEN timestamp <  :s15 THEN price END) as o_p
+    FROM trades
+    WHERE timestamp >= :s60
+    GROUP BY market_name
+"""
+_WHALE_SQL = """
+    SELECT * FROM trades
+    WHERE timestamp >= ? AND usd_value >= 25000
+    ORDER BY usd_value DESC LIMIT 5
+"""
+_NEARRES_SQL = """
+    SELECT market_name, outcome, AVG(price) as avg_p, SUM(usd_value) as vol
+    FROM trades
+    WHERE timestamp >= ? AND (price >= 0.93 OR price <= 0.07)
+    GROUP BY market_name, outcome
+    HAVING vol >= 1000
+    ORDER BY vol DESC LIMIT 5
+"""
+_BROAD_SQL = """
+    SELECT COUNT(DISTINCT market_name) as mkt_count, SUM(usd_value) as total
+    FROM trades WHERE timestamp >= ? AND usd_value >= 1000
+"""
+
 # ── already-alerted signals to avoid spam ─────────────────────────────────────
-alerted = set()
+# Keys embed their hour / 10-minute bucket, so an hour of memory is all dedup needs
+alerted = TTLCache(maxsize=10_000, ttl=3600)
+
+# Keep-alive session to api.telegram.org; 429/5xx retried with backoff
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=None, respect_retry_after_header=True),   # None: retry POST too
+))
+
+# Sends run on worker threads so Telegram latency doesn't stretch the detector scan
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
 
 def send(text):
     if not BOT_TOKEN or not CHAT_ID: return
+    EXECUTOR.submit(_post, text)
+
+def _post(text):
     try:
-        requests.post(
+        SESSION.post(
             f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
-            json={"chat_id": CHAT_ID, "text": text, "parse_mode": "HTML", "disable_web_page_preview": True},
+            data=orjson.dumps({"chat_id": CHAT_ID, "text": text, "parse_mode": "HTML", "disable_web_page_preview": True}),
+            headers={"Content-Type": "application/json"},
             timeout=10
         )
     except Exception as e:
         log.error(f"Telegram error: {e}")
 
+def since_ms(minutes):
+    return int(time.time() * 1000) - minutes * 60_000
+
 def query(sql, params=()):
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    rows = [dict(r) for r in con.execute(sql, params).fetchall()]
-    con.close()
-    return rows
+    # sqlite3.Row already supports r["col"]; hand back the cursor and let callers stream it
+    return get_con().execute(sql, params)
 
 # ── Signal 1: Repeated buys on same market in short window ────────────────────
 def detect_accumulation():
-    since = (datetime.utcnow() - timedelta(minutes=15)).isoformat()
-    rows = query("""
-        SELECT market_name, outcome, COUNT(*) as cnt, SUM(usd_value) as total,
-               AVG(price) as avg_price, MAX(price) as max_price, MIN(price) as min_price
-        FROM trades
-        WHERE timestamp >= ? AND side = 'BUY' AND usd_value >= 200
-        GROUP BY market_name, outcome
-        HAVING cnt >= 3
-        ORDER BY total DESC
-    """, (since,))
+    since = since_ms(15)
+    rows = query(_ACCUM_SQL, (since,))
     for r in rows:
-        key = f"accum_{r['market_name']}_{r['outcome']}_{since[:13]}"
+        key = f"accum_{r['market_name']}_{r['outcome']}_{since // 3_600_000}"
         if key in alerted: continue
-        alerted.add(key)
+        alerted[key] = 1
         price_range = f"{r['min_price']:.3f} → {r['max_price']:.3f}"
         msg = (
             f"📈 <b>ACCUMULATION DETECTED</b>\n\n"
@@ -77,54 +143,40 @@ def detect_accumulation():
 
 # ── Signal 2: Sudden price velocity spike ─────────────────────────────────────
 def detect_price_velocity():
-    since_15 = (datetime.utcnow() - timedelta(minutes=15)).isoformat()
-    since_60 = (datetime.utcnow() - timedelta(minutes=60)).isoformat()
-
-    markets = query("SELECT DISTINCT market_name FROM trades WHERE timestamp >= ?", (since_15,))
-    for m in markets:
-        name = m["market_name"]
-        recent = query("""
-            SELECT AVG(price) as avg_p FROM trades
-            WHERE market_name=? AND timestamp >= ?
-        """, (name, since_15))
-        older = query("""
-            SELECT AVG(price) as avg_p FROM trades
-            WHERE market_name=? AND timestamp >= ? AND timestamp < ?
-        """, (name, since_60, since_15))
-        if not recent or not older: continue
-        r_p = recent[0]["avg_p"]
-        o_p = older[0]["avg_p"]
-        if not r_p or not o_p or o_p == 0: continue
-        move = (r_p - o_p) / o_p
-        if abs(move) >= 0.10:  # 10%+ price move in 15min
-            key = f"velocity_{name}_{since_15[:15]}"
-            if key in alerted: continue
-            alerted.add(key)
-            direction = "🚀 SURGING" if move > 0 else "💥 CRASHING"
-            msg = (
-                f"⚡ <b>PRICE VELOCITY SPIKE</b>\n\n"
-                f"📌 <b>{name[:80]}</b>\n\n"
-                f"{direction}\n"
-                f"📊 Was: <code>{o_p:.3f}</code> ({o_p*100:.1f}¢)\n"
-                f"📊 Now: <code>{r_p:.3f}</code> ({r_p*100:.1f}¢)\n"
-                f"📈 Move: <code>{move*100:+.1f}%</code> in 15min\n\n"
-                f"⚠️ <i>Significant price movement — check for news</i>"
-            )
-            send(msg)
-            log.info(f"⚡ Velocity: {name[:40]} {move*100:+.1f}%")
+    since_15 = since_ms(15)
+    since_60 = since_ms(60)
+
+    rows = query(_VELOCITY_SQL, {"s15": since_15, "s60": since_60}).fetchall()
+    names = [r["market_name"] for r in rows]
+    r_arr = np.array([r["r_p"] for r in rows], dtype=np.float64)   # NULL averages become NaN
+    o_arr = np.array([r["o_p"] for r in rows], dtype=np.float64)
+    moves = np.divide(r_arr - o_arr, o_arr, out=np.zeros_like(o_arr), where=(o_arr > 0) & (r_arr > 0))
+    for i in np.flatnonzero(np.abs(moves) >= 0.10):  # 10%+ price move in 15min
+        name, r_p, o_p, move = names[i], float(r_arr[i]), float(o_arr[i]), float(moves[i])
+        key = f"velocity_{name}_{since_15 // 600_000}"
+        if key in alerted: continue
+        alerted[key] = 1
+        direction = "🚀 SURGING" if move > 0 else "💥 CRASHING"
+        msg = (
+            f"⚡ <b>PRICE VELOCITY SPIKE</b>\n\n"
+            f"📌 <b>{name[:80]}</b>\n\n"
+            f"{direction}\n"
+            f"📊 Was: <code>{o_p:.3f}</code> ({o_p*100:.1f}¢)\n"
+            f"📊 Now: <code>{r_p:.3f}</code> ({r_p*100:.1f}¢)\n"
+            f"📈 Move: <code>{move*100:+.1f}%</code> in 15min\n\n"
+            f"⚠️ <i>Significant price movement — check for news</i>"
+        )
+        send(msg)
+        log.info(f"⚡ Velocity: {name[:40]} {move*100:+.1f}%")
 
 # ── Signal 3: Single massive trade ────────────────────────────────────────────
 def detect_single_whale():
-    since = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
-    rows = query("""
-        SELECT * FROM trades
-        WHERE timestamp >= ? AND usd_value >= 25000
-        ORDER BY usd_value DESC LIMIT 5
-    """, (since,))
+    since = since_ms(5)
+    rows = query(_WHALE_SQL, (since,))
     for r in rows:
         key = f"bigwhale_{r['id']}"
         if key in alerted: continue
-        alerted.add(key)
+        alerted[key] = 1
         msg = (
             f"🐋 <b>MEGA WHALE DETECTED</b>\n\n"
             f"📌 <b>{r['market_name'][:80]}</b>\n"
@@ -138,19 +190,12 @@ def detect_single_whale():
 
 # ── Signal 4: Market approaching resolution (price near 0 or 1) ───────────────
 def detect_near_resolution():
-    since = (datetime.utcnow() - timedelta(minutes=10)).isoformat()
-    rows = query("""
-        SELECT market_name, outcome, AVG(price) as avg_p, SUM(usd_value) as vol
-        FROM trades
-        WHERE timestamp >= ? AND (price >= 0.93 OR price <= 0.07)
-        GROUP BY market_name, outcome
-        HAVING vol >= 1000
-        ORDER BY vol DESC LIMIT 5
-    """, (since,))
+    since = since_ms(10)
+    rows = query(_NEARRES_SQL, (since,))
     for r in rows:
-        key = f"nearres_{r['market_name']}_{since[:13]}"
+        key = f"nearres_{r['market_name']}_{since // 3_600_000}"
         if key in alerted: continue
-        alerted.add(key)
+        alerted[key] = 1
         p = r["avg_p"]
         likely = "YES" if p > 0.5 else "NO"
         conf = p if p > 0.5 else 1 - p
@@ -167,23 +212,20 @@ def detect_near_resolution():
 
 # ── Signal 5: Coordinated multi-market activity ────────────────────────────────
 def detect_broad_activity():
-    since = (datetime.utcnow() - timedelta(minutes=10)).isoformat()
-    rows = query("""
-        SELECT COUNT(DISTINCT market_name) as mkt_count, SUM(usd_value) as total
-        FROM trades WHERE timestamp >= ? AND usd_value >= 1000
-    """, (since,))
-    if rows and rows[0]["mkt_count"] >= 8 and rows[0]["total"] >= 50000:
-        key = f"broad_{since[:15]}"
+    since = since_ms(10)
+    r = query(_BROAD_SQL, (since,)).fetchone()
+    if r["mkt_count"] >= 8 and r["total"] >= 50000:
+        key = f"broad_{since // 600_000}"
         if key not in alerted:
-            alerted.add(key)
+            alerted[key] = 1
             msg = (
                 f"🌊 <b>BROAD MARKET SURGE</b>\n\n"
-                f"🔥 <code>{rows[0]['mkt_count']}</code> markets active simultaneously\n"
-                f"💰 Total flow (10min): <code>${rows[0]['total']:,.0f}</code>\n\n"
+                f"🔥 <code>{r['mkt_count']}</code> markets active simultaneously\n"
+                f"💰 Total flow (10min): <code>${r['total']:,.0f}</code>\n\n"
                 f"⚠️ <i>Unusual broad activity — possible macro event or coordinated trading</i>"
             )
             send(msg)
-            log.info(f"🌊 Broad surge: {rows[0]['mkt_count']} markets ${rows[0]['total']:,.0f}")
+            log.info(f"🌊 Broad surge: {r['mkt_count']} markets ${r['total']:,.0f}")
 
 # ── Main loop ─────────────────────────────────────────────────────────────────
 def main():
@@ -195,6 +237,7 @@ def main():
     log.info(f"Signal engine running | scan every {INTERVAL}s")
     send("🧠 <b>PolyInsider Signal Engine Online</b>\n\nScanning for: accumulation, price velocity, mega whales, near-resolution, broad surges.")
 
+    last_optimize = time.monotonic()
     while True:
         try:
             if DB_PATH.exists():
@@ -203,6 +246,9 @@ def main():
                 detect_single_whale()
                 detect_near_resolution()
                 detect_broad_activity()
+                if time.monotonic() - last_optimize >= OPTIMIZE_EVERY:
+                    get_con().execute("PRAGMA optimize")
+                    last_optimize = time.monotonic()
         except Exception as e:
             log.error(f"Signal scan error: {e}")
         time.sleep(INTERVAL)
@@ -3,10 +3,16 @@ PolyInsider — sonar_insider.py
 Live trade ingestion from Polymarket CLOB WebSocket.
 """
 
-import asyncio, json, sqlite3, logging
-from datetime import datetime
+import asyncio, math, os, sqlite3, logging, threading, time
+from bisect import bisect_right
+from operator import itemgetter
 from pathlib import Path
-import aiohttp, websockets
+import aiohttp, numpy as np, orjson, websockets
+
+try:
+    import uvloop   # optional: libuv event loop, not available on Windows
+except ImportError:
+    uvloop = None
 
 WS_URL         = "wss://ws-subscriptions-clob.polymarket.com/ws/market"
 GAMMA_API      = "https://gamma-api.polymarket.com/markets"
@@ -14,137 +20,308 @@ DB_PATH        = Path(__file__).parent / "insider.db"
 MIN_USD        = 5.0
 TOP_N_MARKETS  = 30
 RECONNECT_DELAY = 5
+FLUSH_ROWS     = 500    # flush buffered trades after this many rows...
+FLUSH_SECS     = 0.5    # ...or this many seconds, whichever comes first
+BUF_ROWS       = 1024   # staging buffer capacity; producers wait for the writer when it's full
+CHECKPOINT_EVERY = 300  # seconds between passive WAL checkpoints
+ANALYZE_ROWS     = 10_000   # trades committed between ANALYZE trades runs
+TICK_PATHS     = (Path(__file__).parent / ".insider_tick", Path(__file__).parent / ".insider_tick_tg")   # FIFOs of watchers waiting for alerts
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [SONAR] %(message)s", datefmt="%H:%M:%S")
 log = logging.getLogger("sonar")
 
-def init_db():
-    con = sqlite3.connect(DB_PATH)
-    con.execute("""CREATE TABLE IF NOT EXISTS trades (
+# Applied once per connection; journal_mode=WAL is persistent and set once in init_db()
+PRAGMAS = ("PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000", "PRAGMA temp_store=MEMORY",
+           "PRAGMA cache_size=-64000", "PRAGMA mmap_size=268435456", "PRAGMA wal_autocheckpoint=1000",
+           "PRAGMA analysis_limit=1000")   # bounded, approximate ANALYZE for optimize on a large table
+
+_CON = None   # single dedicated writer connection, opened lazily
+
+def get_con():
+    global _CON
+    if _CON is None:
+        _CON = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, cached_statements=256)
+        for p in PRAGMAS: _CON.execute(p)
+    return _CON
+
+SCHEMA_VERSION = 2   # 1: timestamp as INTEGER epoch ms (was ISO text) · 2: is_alert generated column
+
+TRADES_DDL = """CREATE TABLE IF NOT EXISTS trades (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT, market_id TEXT, market_name TEXT,
+        timestamp INTEGER NOT NULL, market_id TEXT, market_name TEXT,
         outcome TEXT, price REAL, size REAL, usd_value REAL,
-        side TEXT, score REAL, alert TEXT)""")
+        side TEXT, score REAL, alert TEXT,
+        is_alert INTEGER GENERATED ALWAYS AS (score >= 3.0 AND usd_value >= 500) STORED)"""
+
+def _migrate(con):
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    cols = {r[1]: r[2] for r in con.execute("PRAGMA table_xinfo(trades)")}
+    if not cols or version >= SCHEMA_VERSION: return
+    # STORED generated columns can't be added with ALTER TABLE, so every upgrade rebuilds the table
+    ts = "timestamp"
+    if cols["timestamp"] == "TEXT":
+        ts = "CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER)"
+    log.info(f"Migrating trades schema v{version} → v{SCHEMA_VERSION}...")
+    con.execute("BEGIN")
+    con.execute("ALTER TABLE trades RENAME TO trades_old")
+    con.execute(TRADES_DDL)
+    con.execute(f"""INSERT INTO trades
+        (id,timestamp,market_id,market_name,outcome,price,size,usd_value,side,score,alert)
+        SELECT id, {ts}, market_id,market_name,outcome,price,size,usd_value,side,score,alert
+        FROM trades_old WHERE timestamp IS NOT NULL""")
+    con.execute("DROP TABLE trades_old")
+    con.execute("COMMIT")
+
+def init_db():
+    con = get_con()
+    con.execute("PRAGMA journal_mode=WAL")
+    _migrate(con)
+    con.execute(TRADES_DDL)
+    # Back the watcher/signal range scans; (timestamp, usd_value) also serves plain timestamp ranges
+    con.execute("CREATE INDEX IF NOT EXISTS idx_trades_ts_usd ON trades(timestamp, usd_value)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_trades_market_ts ON trades(market_name, timestamp)")
+    # Dashboard min-score filter: score range first, then usd/timestamp checked from the index
+    con.execute("CREATE INDEX IF NOT EXISTS idx_trades_score_ts ON trades(score, usd_value, timestamp)")
+    # Partial indexes for the hot alert predicates (watchers, mega whales, near-resolution band)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_trades_alerts ON trades(id) WHERE is_alert = 1")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_trades_whales ON trades(timestamp) WHERE usd_value >= 25000")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_trades_nearres ON trades(timestamp) WHERE price >= 0.93 OR price <= 0.07")
     con.execute("""CREATE TABLE IF NOT EXISTS markets (
         token_id TEXT PRIMARY KEY, name TEXT, question TEXT,
         volume_24h REAL, last_seen TEXT)""")
-    con.commit(); con.close()
+    con.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    # No planner stats for trades yet (fresh file, or analyzed while empty): collect them once so
+    # the planner can weigh the composite and partial indexes
+    if not (con.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+            and con.execute("SELECT 1 FROM sqlite_stat1 WHERE tbl='trades'").fetchone()):
+        con.execute("ANALYZE trades"); con.execute("ANALYZE markets")
+    con.execute("PRAGMA optimize=0x10002")
     log.info(f"DB ready at {DB_PATH}")
 
-def insert_trade(t):
-    con = sqlite3.connect(DB_PATH)
-    con.execute("""INSERT INTO trades
-        (timestamp,market_id,market_name,outcome,price,size,usd_value,side,score,alert)
-        VALUES (:timestamp,:market_id,:market_name,:outcome,:price,:size,:usd_value,:side,:score,:alert)""", t)
-    con.commit(); con.close()
-
-def upsert_market(token_id, name, volume):
-    con = sqlite3.connect(DB_PATH)
-    con.execute("""INSERT INTO markets (token_id,name,question,volume_24h,last_seen)
-        VALUES (?,?,?,?,?)
-        ON CONFLICT(token_id) DO UPDATE SET
-        name=excluded.name, volume_24h=excluded.volume_24h, last_seen=excluded.last_seen""",
-        (token_id, name[:80], name, volume, datetime.utcnow().isoformat()))
-    con.commit(); con.close()
+TRADE_COLS  = ("timestamp","market_id","market_name","outcome","price","size","usd_value","side","score","alert")
+_INSERT_SQL = f"INSERT INTO trades ({','.join(TRADE_COLS)}) VALUES ({','.join('?' * len(TRADE_COLS))})"
+_alert_cols = itemgetter(TRADE_COLS.index("score"), TRADE_COLS.index("usd_value"))
+
+# Struct-of-arrays staging buffer: numeric columns in preallocated NumPy arrays, strings in
+# plain lists, so buffering a trade is a handful of slot writes instead of a dict per trade
+NUM_COLS = {"timestamp": "i8", "price": "f8", "size": "f8", "usd_value": "f8", "score": "f8"}
+BUF = {c: np.empty(BUF_ROWS, NUM_COLS[c]) if c in NUM_COLS else [None] * BUF_ROWS for c in TRADE_COLS}
+_buf_n     = 0
+_buf_cond  = threading.Condition()   # guards BUF/_buf_n; signalled at FLUSH_ROWS and when drained
+_stop      = threading.Event()       # set by stop_writer(); writer_loop flushes and exits
+_writer    = None
+
+def insert_trade(timestamp, market_id, market_name, outcome, price, size, usd_value, side, score, alert):
+    # Only stages the row: the event loop never touches SQLite, writer_loop commits it
+    global _buf_n
+    with _buf_cond:
+        while _buf_n == BUF_ROWS:   # writer fell behind: hand it the full buffer and wait for room
+            _buf_cond.notify_all()
+            _buf_cond.wait()
+        i = _buf_n
+        BUF["timestamp"][i] = timestamp; BUF["market_id"][i] = market_id; BUF["market_name"][i] = market_name
+        BUF["outcome"][i] = outcome; BUF["price"][i] = price; BUF["size"][i] = size
+        BUF["usd_value"][i] = usd_value; BUF["side"][i] = side; BUF["score"][i] = score; BUF["alert"][i] = alert
+        _buf_n = i + 1
+        if _buf_n == FLUSH_ROWS: _buf_cond.notify_all()
+
+def drain_buffer():
+    # Caller holds _buf_cond
+    global _buf_n
+    n, _buf_n = _buf_n, 0
+    return list(zip(*(BUF[c][:n].tolist() if c in NUM_COLS else BUF[c][:n] for c in TRADE_COLS)))
+
+def flush_trades(rows):
+    con = get_con()
+    con.execute("BEGIN")
+    try:
+        con.executemany(_INSERT_SQL, rows)
+        con.execute("COMMIT")
+    except sqlite3.Error:
+        con.execute("ROLLBACK")
+        raise
+
+def write_batch(batch):
+    try:
+        flush_trades(batch)
+    except sqlite3.Error as e:
+        log.error(f"Dropped {len(batch)} trades: {e}")
+        return
+    # Same predicate as the is_alert column: only wake watchers when there is something to send
+    if any(score >= 3.0 and usd >= 500 for score, usd in map(_alert_cols, batch)):
+        notify_tick()
+
+def housekeeping(checkpoint, analyze, optimize=False):
+    # Bounded WAL (no auto-checkpoint stall on a commit) and fresh planner stats for the readers
+    con = get_con()
+    if checkpoint:
+        con.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    if analyze:
+        # Explicit ANALYZE, bounded by analysis_limit: before SQLite 3.46 PRAGMA optimize only
+        # looks at tables this connection queried, and the writer only ever INSERTs
+        con.execute("ANALYZE trades")
+    if optimize:
+        con.execute("PRAGMA optimize=0x10002")   # 0x10000: consider every table, not just ones this connection queried
+
+def writer_loop():
+    """Owns the writer connection: commits staged trades in batches and runs housekeeping."""
+    last_checkpoint, since_analyze = time.monotonic(), 0
+    while True:
+        stopping = _stop.is_set()
+        with _buf_cond:
+            if _buf_n < FLUSH_ROWS and not stopping:
+                _buf_cond.wait(FLUSH_SECS)
+            batch = drain_buffer() if _buf_n else None
+            _buf_cond.notify_all()
+        if batch:
+            write_batch(batch)
+            since_analyze += len(batch)
+        now = time.monotonic()
+        checkpoint = now - last_checkpoint >= CHECKPOINT_EVERY
+        analyze = since_analyze >= ANALYZE_ROWS
+        if checkpoint or analyze or stopping:
+            try:
+                housekeeping(checkpoint, analyze, optimize=stopping)   # always leave stats behind on exit
+            except sqlite3.Error as e:
+                log.warning(f"Housekeeping failed: {e}")
+            if checkpoint: last_checkpoint = now
+            if analyze: since_analyze = 0
+        if stopping: return
+
+def start_writer():
+    global _writer
+    _writer = threading.Thread(target=writer_loop, name="sqlite-writer", daemon=True)
+    _writer.start()
+
+def stop_writer(timeout=5.0):
+    """Have writer_loop commit whatever is still staged, run PRAGMA optimize and exit."""
+    _stop.set()
+    with _buf_cond: _buf_cond.notify_all()
+    if _writer: _writer.join(timeout)
+
+def notify_tick():
+    for path in TICK_PATHS:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:   # no FIFO, or nobody is reading it
+            continue
+        try:
+            os.write(fd, b"\x01")
+        except BlockingIOError:   # pipe full: the watcher already has a wakeup pending
+            pass
+        finally:
+            os.close(fd)
+
+_UPSERT_MARKET_SQL = """INSERT INTO markets (token_id,name,question,volume_24h,last_seen)
+    VALUES (?,?,?,?,?)
+    ON CONFLICT(token_id) DO UPDATE SET
+    name=excluded.name, volume_24h=excluded.volume_24h, last_seen=excluded.last_seen"""
+
+def upsert_markets(rows):
+    con = get_con()
+    con.execute("BEGIN")
+    try:
+        con.executemany(_UPSERT_MARKET_SQL, rows)
+        con.execute("COMMIT")
+    except sqlite3.Error:
+        con.execute("ROLLBACK")
+        raise
+
+def _tokens(m):
+    # clobTokenIds comes as a JSON string — parse it
+    raw = m.get("clobTokenIds") or "[]"
+    return orjson.loads(raw) if isinstance(raw, str) else raw
 
 async def fetch_markets():
     log.info("Fetching top markets from Gamma API...")
     params = {"limit":50,"order":"volume24hr","ascending":"false","active":"true","closed":"false"}
-    async with aiohttp.ClientSession() as s:
+    # One request to one host: a single pooled connection with DNS cached for the session
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1, ttl_dns_cache=300)) as s:
         async with s.get(GAMMA_API, params=params) as r:
-            data = await r.json()
-
-    token_ids = []
-    name_map  = {}
-    count = 0
-    for m in data:
-        if count >= TOP_N_MARKETS: break
-        question = m.get("question","?")
-        volume   = float(m.get("volume24hr") or 0)
-        # clobTokenIds comes as a JSON string — parse it
-        raw = m.get("clobTokenIds", "[]")
-        tokens = json.loads(raw) if isinstance(raw, str) else raw
-        if not tokens: continue
-        for t in tokens[:2]:  # YES + NO only
-            tid = str(t)
-            token_ids.append(tid)
-            name_map[tid] = question
-            upsert_market(tid, question, volume)
-        count += 1
-        log.info(f"  #{count:02d} ${volume:>12,.0f} | {question[:55]}")
-
-    log.info(f"Tracking {len(token_ids)} tokens across {count} markets")
+            data = orjson.loads(await r.read())
+
+    # Single pass: first TOP_N_MARKETS markets that have tokens, YES + NO only
+    markets = [(m.get("question","?"), float(m.get("volume24hr") or 0), tokens[:2])
+               for m in data if (tokens := _tokens(m))][:TOP_N_MARKETS]
+    seen = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+    rows = [(str(t), q[:80], q, vol, seen) for q, vol, tokens in markets for t in tokens]
+    upsert_markets(rows)   # one transaction for every token
+
+    token_ids = [r[0] for r in rows]
+    name_map  = {r[0]: r[2] for r in rows}
+    for i, (q, vol, _) in enumerate(markets, 1):
+        log.info(f"  #{i:02d} ${vol:>12,.0f} | {q[:55]}")
+    log.info(f"Tracking {len(token_ids)} tokens across {len(markets)} markets")
     return token_ids, name_map
 
+# score_trade as table lookups: bisect picks the USD tier and the price band, and the
+# (score, alert) pair for every combination is built once at import.
+_USD_CUT     = (500, 2000, 10000, 25000)
+_USD_SCORE   = (0.5, 1.5, 2.5, 4.0, 5.0)
+_USD_MSG     = ("", "📊 Mid (>$500)", "🦈 Large (>$2k)", "🐳 WHALE (>$10k)", "🐋 MEGA WHALE (>$25k)")
+# The ≤15¢ and ≤55¢ bounds are inclusive, so those cuts sit one ulp above them
+_PRICE_CUT   = (math.nextafter(0.15, 1), 0.45, math.nextafter(0.55, 1), 0.85)
+_PRICE_SCORE = (1.5, 0.0, 0.5, 0.0, 2.0)
+_PRICE_MSG   = ("💎 Contrarian (≤15¢)", "", "⚖️ Near 50/50", "", "🔥 Late sniper (≥85¢)")
+_SCORES = tuple(
+    tuple((round(us + ps, 2), " | ".join(filter(None, (um, pm))) or "Standard trade")
+          for ps, pm in zip(_PRICE_SCORE, _PRICE_MSG))
+    for us, um in zip(_USD_SCORE, _USD_MSG))
+
 def score_trade(usd, price):
-    score, reasons = 0.0, []
-    if usd >= 25000: score += 5.0; reasons.append("🐋 MEGA WHALE (>$25k)")
-    elif usd >= 10000: score += 4.0; reasons.append("🐳 WHALE (>$10k)")
-    elif usd >= 2000:  score += 2.5; reasons.append("🦈 Large (>$2k)")
-    elif usd >= 500:   score += 1.5; reasons.append("📊 Mid (>$500)")
-    else: score += 0.5
-    if price >= 0.85:   score += 2.0; reasons.append("🔥 Late sniper (≥85¢)")
-    elif price <= 0.15: score += 1.5; reasons.append("💎 Contrarian (≤15¢)")
-    elif 0.45 <= price <= 0.55: score += 0.5; reasons.append("⚖️ Near 50/50")
-    return round(score, 2), " | ".join(reasons) or "Standard trade"
+    return _SCORES[bisect_right(_USD_CUT, usd)][bisect_right(_PRICE_CUT, price)]
+
+TRADE_EVENTS = frozenset({"trade", "TRADE"})
+PRICE_EVENTS = frozenset({"price_change", "last_trade_price"})
+
+def _record(ts, asset_id, market_name, price, size, side):
+    usd = price * size
+    if usd < MIN_USD or price <= 0: return   # also rejects size <= 0, since MIN_USD > 0
+    score, alert = score_trade(usd, price)
+    insert_trade(ts, asset_id, market_name, "YES" if price > 0.5 else "NO",
+                 price, size, round(usd,2), side, score, alert)
+    if score >= 3.0:
+        log.info(f"🚨 {alert} | {market_name[:40]} | ${usd:,.0f}")
 
 async def run():
     token_ids, name_map = await fetch_markets()
-    sub = json.dumps({"type":"market","assets_ids": token_ids})
+    # Started after the market upserts so only this thread uses the writer connection from here on
+    start_writer()
+    sub = orjson.dumps({"type":"market","assets_ids": token_ids}).decode()
 
     while True:
         try:
             log.info(f"Connecting to WebSocket ({len(token_ids)} tokens)...")
-            async with websockets.connect(WS_URL, ping_interval=20, ping_timeout=30) as ws:
+            # No permessage-deflate: CLOB frames are small and inflating each one costs more than it saves
+            async with websockets.connect(WS_URL, ping_interval=20, ping_timeout=30,
+                                          max_size=2**22, compression=None) as ws:
                 await ws.send(sub)
                 log.info("✅ Subscribed. Listening for trades...")
-                async for raw in ws:
-                    if raw == "ping": await ws.send("pong"); continue
+                while True:
+                    # decode=False: keep text frames as bytes (no UTF-8 decode); orjson parses bytes directly
+                    raw = await ws.recv(decode=False)
+                    if raw == b"ping": await ws.send("pong"); continue
                     try:
-                        events = json.loads(raw)
+                        events = orjson.loads(raw)
                         if not isinstance(events, list): events = [events]
+                        ts = time.time_ns() // 1_000_000   # one integer ms timestamp per frame, no float math
                         for ev in events:
                             etype = ev.get("event_type") or ev.get("type","")
-                            # Handle orderbook price change events
                             asset_id = ev.get("asset_id","")
                             market_name = name_map.get(asset_id, asset_id[:16])
 
                             # trade events
-                            if etype in ("trade","TRADE"):
-                                price = float(ev.get("price",0))
-                                size  = float(ev.get("size",0))
-                                side  = ev.get("side","UNKNOWN")
-                                usd   = price * size
-                                if usd < MIN_USD or price <= 0: continue
-                                score, alert = score_trade(usd, price)
-                                t = dict(timestamp=datetime.utcnow().isoformat(),
-                                         market_id=asset_id, market_name=market_name,
-                                         outcome="YES" if price > 0.5 else "NO",
-                                         price=price, size=size, usd_value=round(usd,2),
-                                         side=side, score=score, alert=alert)
-                                insert_trade(t)
-                                if score >= 3.0:
-                                    log.info(f"🚨 {alert} | {market_name[:40]} | ${usd:,.0f}")
+                            if etype in TRADE_EVENTS:
+                                _record(ts, asset_id, market_name, float(ev.get("price",0)),
+                                        float(ev.get("size",0)), ev.get("side","UNKNOWN"))
 
                             # price_change gives us last trade info
-                            elif etype in ("price_change","last_trade_price") or "price" in ev:
-                                price = float(ev.get("price") or ev.get("last_trade_price") or 0)
-                                size  = float(ev.get("size") or ev.get("amount") or 0)
-                                if price <= 0 or size <= 0: continue
-                                side  = ev.get("side","BUY")
-                                usd   = price * size
-                                if usd < MIN_USD: continue
-                                score, alert = score_trade(usd, price)
-                                t = dict(timestamp=datetime.utcnow().isoformat(),
-                                         market_id=asset_id, market_name=market_name,
-                                         outcome="YES" if price > 0.5 else "NO",
-                                         price=price, size=size, usd_value=round(usd,2),
-                                         side=side, score=score, alert=alert)
-                                insert_trade(t)
-                                if score >= 3.0:
-                                    log.info(f"🚨 {alert} | {market_name[:40]} | ${usd:,.0f}")
-
-                    except (json.JSONDecodeError, ValueError, KeyError):
+                            elif etype in PRICE_EVENTS or "price" in ev:
+                                _record(ts, asset_id, market_name,
+                                        float(ev.get("price") or ev.get("last_trade_price") or 0),
+                                        float(ev.get("size") or ev.get("amount") or 0), ev.get("side","BUY"))
+
+                    except (orjson.JSONDecodeError, ValueError, KeyError):
                         continue
 
         except (websockets.ConnectionClosed, OSError) as e:
@@ -156,5 +333,9 @@ async def run():
 
 if __name__ == "__main__":
     init_db()
-    log.info("🚀 PolyInsider Sonar starting...")
-    asyncio.run(run())
+    log.info(f"🚀 PolyInsider Sonar starting{' (uvloop)' if uvloop else ''}...")
+    try:
+        if uvloop: uvloop.run(run())
+        else: asyncio.run(run())
+    finally:
+        stop_writer()
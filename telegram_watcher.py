@@ -3,9 +3,10 @@ PolyInsider — telegram_watcher.py
 Monitors insider.db for high-value trades and pushes alerts to Telegram.
 """
 
-import sqlite3, time, logging, os, requests
+import asyncio, sqlite3, logging, os
+import aiohttp, orjson
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,32 +14,83 @@ load_dotenv()
 DB_PATH        = Path(__file__).parent / "insider.db"
 BOT_TOKEN      = os.getenv("TELEGRAM_BOT_TOKEN", "")
 CHAT_ID        = os.getenv("TELEGRAM_CHAT_ID", "")
-CHECK_INTERVAL = 15
+CHECK_INTERVAL = 15     # safety-net poll while waiting on the tick FIFO
+FALLBACK_SECS  = 5      # poll interval when no FIFO can be opened
+TICK_PATH      = Path(__file__).parent / ".insider_tick_tg"   # sonar_insider writes here on new alerts
 MIN_SCORE      = 3.0
 MIN_USD        = 500
 WHALE_USD      = 10_000
 DIGEST_SECS    = 3600
+SEND_SPACING   = 0.5    # min gap between messages; Telegram allows ~1/s per chat with short bursts
+SEND_RETRIES   = 3
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [TG] %(message)s", datefmt="%H:%M:%S")
 log = logging.getLogger("tg_watcher")
 
+# WAL is enabled by sonar_insider.init_db(); these are per-connection settings
+PRAGMAS = ("PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000", "PRAGMA temp_store=MEMORY",
+           "PRAGMA cache_size=-20000", "PRAGMA mmap_size=268435456")
+
+# Volume, trade count and whale count in one pass over the window
+_DIGEST_SQL = ("SELECT COALESCE(SUM(usd_value),0), COUNT(*), COALESCE(SUM(CASE WHEN usd_value>=? THEN 1 ELSE 0 END),0) "
+               "FROM trades WHERE timestamp>=?")
+_TOP_SQL    = "SELECT market_name, SUM(usd_value) vol, COUNT(*) cnt FROM trades WHERE timestamp>=? GROUP BY market_name ORDER BY vol DESC LIMIT 5"
+_POLL_SQL   = ("SELECT * FROM trades INDEXED BY idx_trades_alerts "
+               "WHERE id>? AND is_alert=1 AND score>=? AND usd_value>=? ORDER BY id ASC LIMIT 20")
+_MAX_ID_SQL = "SELECT COALESCE(MAX(id),0) FROM trades"
+
+_CON = None   # one long-lived read connection for the whole process
+
+def get_con():
+    global _CON
+    if _CON is None:
+        _CON = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+        _CON.row_factory = sqlite3.Row
+        for p in PRAGMAS: _CON.execute(p)
+    return _CON
+
+SEND_URL     = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+JSON_HEADERS = {"Content-Type": "application/json"}
+
 last_seen_id = 0
 last_digest  = datetime.utcnow()
 
-def send_message(text):
-    if not BOT_TOKEN or not CHAT_ID:
-        log.warning("Token or chat ID missing")
-        return False
+async def retry_after(r, default):
+    """Back-off for a 429: Retry-After header, then Telegram's parameters.retry_after, else default.
+    Proxies and CDNs answer 429 with HTML, so an unparseable body just means the default."""
     try:
-        r = requests.post(
-            f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
-            json={"chat_id": CHAT_ID, "text": text, "parse_mode": "HTML", "disable_web_page_preview": True},
-            timeout=10
-        )
-        return r.status_code == 200
-    except Exception as e:
-        log.error(f"Send error: {e}")
-        return False
+        if "Retry-After" in r.headers:
+            return float(r.headers["Retry-After"])
+        return float(orjson.loads(await r.read())["parameters"]["retry_after"])
+    except (ValueError, TypeError, KeyError, AttributeError, aiohttp.ClientError):
+        return default
+
+async def send_message(http, text):
+    payload = orjson.dumps({"chat_id": CHAT_ID, "text": text, "parse_mode": "HTML", "disable_web_page_preview": True})
+    for attempt in range(SEND_RETRIES + 1):
+        delay = 0.3 * 2 ** attempt
+        try:
+            async with http.post(SEND_URL, data=payload, headers=JSON_HEADERS) as r:
+                if r.status == 200: return True
+                if r.status != 429 and r.status < 500:
+                    log.error(f"Send failed: HTTP {r.status}"); return False
+                log.warning(f"Send got HTTP {r.status} (attempt {attempt + 1}/{SEND_RETRIES + 1})")
+                if r.status == 429:   # flood control: back off as long as we're told
+                    delay = await retry_after(r, delay)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.error(f"Send error: {e}")
+        if attempt < SEND_RETRIES:
+            await asyncio.sleep(delay)
+    log.error(f"Dropped message after {SEND_RETRIES + 1} attempts")
+    return False
+
+async def sender(http, queue):
+    """Sole consumer of the outbox, so messages go out in order and SEND_SPACING apart
+    while polling and the digest carry on."""
+    while True:
+        text = await queue.get()
+        await send_message(http, text)
+        await asyncio.sleep(SEND_SPACING)
 
 def build_alert(t):
     usd, price, score = t["usd_value"], t["price"], t["score"]
@@ -51,26 +103,24 @@ def build_alert(t):
     else:
         hdr, bar = "📊 <b>Trade Alert</b>", "🟢🟢🟢⬜⬜"
     stars = "⭐" * min(5, int(score))
+    ts = datetime.fromtimestamp(t["timestamp"] / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     return (
         f"{hdr}\n\n"
         f"📌 <b>{t['market_name'][:80]}</b>\n"
-        f"🎯 Outcome: <code>{t.get('outcome','')}</code>\n\n"
+        f"🎯 Outcome: <code>{t['outcome']}</code>\n\n"
         f"💰 Value:  <code>${usd:>10,.2f}</code>\n"
         f"📈 Price:  <code>{price:.4f}</code>  ({price*100:.1f}¢)\n"
         f"🔥 Score:  {stars} <code>{score:.1f}/5</code>  {bar}\n\n"
-        f"🔍 <i>{t.get('alert','')}</i>\n\n"
-        f"⏰ <code>{str(t.get('timestamp',''))[:19]} UTC</code>"
+        f"🔍 <i>{t['alert']}</i>\n\n"
+        f"⏰ <code>{ts} UTC</code>"
     )
 
 def build_digest(since_dt):
     if not DB_PATH.exists(): return "No data yet."
-    since = since_dt.isoformat()
-    con = sqlite3.connect(DB_PATH); con.row_factory = sqlite3.Row
-    vol   = con.execute("SELECT COALESCE(SUM(usd_value),0) FROM trades WHERE timestamp>=?", (since,)).fetchone()[0]
-    cnt   = con.execute("SELECT COUNT(*) FROM trades WHERE timestamp>=?", (since,)).fetchone()[0]
-    whal  = con.execute("SELECT COUNT(*) FROM trades WHERE timestamp>=? AND usd_value>=?", (since, WHALE_USD)).fetchone()[0]
-    top   = con.execute("SELECT market_name, SUM(usd_value) vol, COUNT(*) cnt FROM trades WHERE timestamp>=? GROUP BY market_name ORDER BY vol DESC LIMIT 5", (since,)).fetchall()
-    con.close()
+    since = int(since_dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    con = get_con()
+    vol, cnt, whal = con.execute(_DIGEST_SQL, (WHALE_USD, since)).fetchone()
+    top   = con.execute(_TOP_SQL, (since,)).fetchall()
     top_str = "\n".join([f"  {i+1}. {r['market_name'][:45]}\n     └ <code>${r['vol']:,.0f}</code> ({r['cnt']} trades)" for i,r in enumerate(top)]) or "  None"
     return (
         f"📋 <b>PolyInsider Hourly Digest</b>\n"
@@ -85,43 +135,68 @@ def build_digest(since_dt):
 def poll():
     global last_seen_id
     if not DB_PATH.exists(): return []
-    con = sqlite3.connect(DB_PATH); con.row_factory = sqlite3.Row
-    rows = [dict(r) for r in con.execute(
-        "SELECT * FROM trades WHERE id>? AND score>=? AND usd_value>=? ORDER BY id ASC LIMIT 20",
-        (last_seen_id, MIN_SCORE, MIN_USD)
-    ).fetchall()]
-    con.close()
+    rows = get_con().execute(_POLL_SQL, (last_seen_id, MIN_SCORE, MIN_USD)).fetchall()
     if rows: last_seen_id = rows[-1]["id"]
     return rows
 
-def main():
+def open_tick():
+    """Open the tick FIFO, creating it if needed. None means fall back to plain polling."""
+    try:
+        if not TICK_PATH.exists(): os.mkfifo(TICK_PATH)
+        # O_RDWR keeps a writer attached, so the loop's reader doesn't spin on EOF between sonar writes
+        return os.open(TICK_PATH, os.O_RDWR | os.O_NONBLOCK)
+    except (OSError, AttributeError):   # AttributeError: no mkfifo on this platform
+        return None
+
+def _on_tick(fd, event):
+    try: os.read(fd, 4096)   # drain every pending tick; one poll covers them all
+    except BlockingIOError: pass
+    event.set()
+
+async def wait_tick(fd, event):
+    if fd is None:
+        await asyncio.sleep(FALLBACK_SECS); return
+    try: await asyncio.wait_for(event.wait(), CHECK_INTERVAL)
+    except asyncio.TimeoutError: pass
+    event.clear()
+
+async def main():
     global last_seen_id, last_digest
     if not BOT_TOKEN or not CHAT_ID:
         log.error("Set TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID in .env"); return
-    log.info(f"Watching {DB_PATH} | interval={CHECK_INTERVAL}s | min=${MIN_USD} score>={MIN_SCORE}")
+    log.info(f"Watching {DB_PATH} | tick={TICK_PATH.name} interval={CHECK_INTERVAL}s | min=${MIN_USD} score>={MIN_SCORE}")
     if DB_PATH.exists():
-        con = sqlite3.connect(DB_PATH)
-        last_seen_id = con.execute("SELECT COALESCE(MAX(id),0) FROM trades").fetchone()[0]
-        con.close(); log.info(f"Seeded from trade ID {last_seen_id}")
-    send_message(
+        last_seen_id = (await asyncio.to_thread(lambda: get_con().execute(_MAX_ID_SQL).fetchone()))[0]
+        log.info(f"Seeded from trade ID {last_seen_id}")
+    tick_fd, tick = open_tick(), asyncio.Event()
+    if tick_fd is not None:
+        asyncio.get_running_loop().add_reader(tick_fd, _on_tick, tick_fd, tick)
+    outbox = asyncio.Queue()
+    outbox.put_nowait(
         f"🚀 <b>PolyInsider Online</b>\n\n"
         f"⚡ Interval: <code>{CHECK_INTERVAL}s</code>\n"
         f"💰 Min: <code>${MIN_USD:,}</code> | Score: <code>{MIN_SCORE}</code>\n"
         f"🐳 Whale threshold: <code>${WHALE_USD:,}</code>"
     )
-    while True:
-        try:
-            for t in poll():
-                log.info(f"🚨 {t['market_name'][:40]} | ${t['usd_value']:,.0f}")
-                send_message(build_alert(t))
-                time.sleep(0.5)
-            if (datetime.utcnow() - last_digest).seconds >= DIGEST_SECS:
-                send_message(build_digest(last_digest))
-                last_digest = datetime.utcnow()
-                log.info("📋 Digest sent")
-        except Exception as e:
-            log.error(f"Error: {e}")
-        time.sleep(CHECK_INTERVAL)
+    # Keep-alive session: one TLS handshake to api.telegram.org for every message
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=4, ttl_dns_cache=300),
+                                     timeout=aiohttp.ClientTimeout(total=10)) as http:
+        send_task = asyncio.create_task(sender(http, outbox))
+        while True:
+            try:
+                # sqlite stays off the event loop
+                for t in await asyncio.to_thread(poll):
+                    log.info(f"🚨 {t['market_name'][:40]} | ${t['usd_value']:,.0f}")
+                    outbox.put_nowait(build_alert(t))
+                if (datetime.utcnow() - last_digest).seconds >= DIGEST_SECS:
+                    outbox.put_nowait(await asyncio.to_thread(build_digest, last_digest))
+                    last_digest = datetime.utcnow()
+                    log.info("📋 Digest queued")
+            except Exception as e:
+                log.error(f"Error: {e}")
+            if send_task.done():   # never expected; surface it rather than queue into the void
+                raise send_task.exception() or RuntimeError("sender stopped")
+            await wait_tick(tick_fd, tick)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
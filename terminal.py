@@ -7,7 +7,7 @@ Run: streamlit run terminal.py
 import sqlite3
 import time
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import pandas as pd
 import plotly.express as px
@@ -50,31 +50,59 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ─── Data Loading ──────────────────────────────────────────────────────────────
+# WAL is enabled by sonar_insider.init_db(); these are per-connection settings
+PRAGMAS = ("PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000", "PRAGMA temp_store=MEMORY",
+           "PRAGMA cache_size=-20000", "PRAGMA mmap_size=268435456")
+
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    """One read-only connection shared by every session and rerun; never closed."""
+    con = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    for p in PRAGMAS:
+        con.execute(p)
+    return con
+
+# Halve the numeric columns and store the low-cardinality labels as codes
+TRADE_DTYPES = {"price": "float32", "size": "float32", "usd_value": "float32", "score": "float32",
+                "outcome": "category", "side": "category"}
+
 @st.cache_data(ttl=5)
-def load_trades(hours: int = 24, min_usd: float = 0) -> pd.DataFrame:
+def load_trades(hours: int = 24, min_usd: float = 0, min_score: float = 0) -> pd.DataFrame:
     if not DB_PATH.exists():
         return pd.DataFrame()
-    con = sqlite3.connect(DB_PATH)
-    since = (datetime.utcnow() - timedelta(hours=hours)).isoformat()
-    df = pd.read_sql("""
+    since = int(time.time() * 1000) - hours * 3_600_000
+    return pd.read_sql_query("""
         SELECT timestamp, market_name, outcome, price, size, usd_value, side, score, alert
         FROM trades
-        WHERE timestamp >= ? AND usd_value >= ?
+        WHERE timestamp >= ? AND usd_value >= ? AND score >= ?
         ORDER BY timestamp DESC
-    """, con, params=(since, min_usd))
-    con.close()
-    if not df.empty:
-        df["timestamp"] = pd.to_datetime(df["timestamp"])
-    return df
+    """, get_conn(), params=(since, min_usd, min_score), parse_dates={"timestamp": {"unit": "ms"}},
+       dtype=TRADE_DTYPES)
+
+# Live Wire / Whale Feed only render a few dozen rows: plain Rows, no DataFrame
+_RECENT_SQL = """
+    SELECT timestamp, market_name, outcome, price, usd_value, side, score, alert
+    FROM trades
+    WHERE timestamp >= ? AND usd_value >= ? AND score >= ?
+    ORDER BY timestamp DESC LIMIT ?
+"""
+
+def load_recent(limit: int = 50, hours: int = 24, min_usd: float = 0, min_score: float = 0) -> list[sqlite3.Row]:
+    if not DB_PATH.exists():
+        return []
+    cur = get_conn().cursor()
+    cur.row_factory = sqlite3.Row
+    since = int(time.time() * 1000) - hours * 3_600_000
+    return cur.execute(_RECENT_SQL, (since, min_usd, min_score, limit)).fetchall()
+
+def hms(ms: int) -> str:
+    return time.strftime("%H:%M:%S", time.gmtime(ms / 1000))
 
 @st.cache_data(ttl=30)
 def load_markets() -> pd.DataFrame:
     if not DB_PATH.exists():
         return pd.DataFrame()
-    con = sqlite3.connect(DB_PATH)
-    df = pd.read_sql("SELECT name, MAX(volume_24h) as volume_24h, MAX(last_seen) as last_seen FROM markets GROUP BY name ORDER BY volume_24h DESC", con)
-    con.close()
-    return df
+    return pd.read_sql("SELECT name, MAX(volume_24h) as volume_24h, MAX(last_seen) as last_seen FROM markets GROUP BY name ORDER BY volume_24h DESC", get_conn())
 
 # ─── Sidebar ───────────────────────────────────────────────────────────────────
 with st.sidebar:
@@ -96,9 +124,7 @@ st.markdown("# 📡 POLYINSIDER TERMINAL")
 st.markdown(f"`{datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}` — Live Prediction Market Intelligence")
 
 # ─── Load Data ────────────────────────────────────────────────────────────────
-df = load_trades(hours=hours, min_usd=min_usd)
-if not df.empty and min_score > 0:
-    df = df[df["score"] >= min_score]
+df = load_trades(hours=hours, min_usd=min_usd, min_score=min_score)
 
 # ─── Top Metrics ──────────────────────────────────────────────────────────────
 st.divider()
@@ -120,30 +146,30 @@ col5.metric("🔥 Top Market",     top_market)
 st.divider()
 st.markdown("### ⚡ LIVE WIRE — Recent Trades")
 
-if df.empty:
+recent = load_recent(50, hours, min_usd, min_score)
+if not recent:
     st.info("⏳ No trades yet. Make sure `sonar_insider.py` is running.")
 else:
-    wire = df.head(50).copy()
-    wire["time"]   = wire["timestamp"].dt.strftime("%H:%M:%S")
-    wire["$value"] = wire["usd_value"].apply(lambda x: f"${x:,.0f}")
-    wire["price"]  = wire["price"].apply(lambda x: f"{x:.3f}")
-
-    def tag(row):
-        if row["score"] >= 5.0: return f"🐳 {row['alert']}"
-        if row["score"] >= 3.0: return f"🦈 {row['alert']}"
-        return row["alert"]
-    wire["signal"] = wire.apply(tag, axis=1)
+    wire = [{
+        "time":        hms(t["timestamp"]),
+        "market_name": t["market_name"],
+        "outcome":     t["outcome"],
+        "price":       t["price"],
+        "usd_value":   t["usd_value"],
+        "side":        t["side"],
+        "signal":      ("🐳 " if t["score"] >= 5.0 else "🦈 " if t["score"] >= 3.0 else "") + t["alert"],
+    } for t in recent]
 
     st.dataframe(
-        wire[["time", "market_name", "outcome", "price", "$value", "side", "signal"]],
+        wire,
         use_container_width=True,
         hide_index=True,
         column_config={
             "time":        st.column_config.TextColumn("TIME", width=80),
             "market_name": st.column_config.TextColumn("MARKET", width=300),
             "outcome":     st.column_config.TextColumn("SIDE", width=60),
-            "price":       st.column_config.TextColumn("PRICE", width=70),
-            "$value":      st.column_config.TextColumn("VALUE", width=90),
+            "price":       st.column_config.NumberColumn("PRICE", width=70, format="%.3f"),
+            "usd_value":   st.column_config.NumberColumn("VALUE", width=90, format="$%,.0f"),
             "side":        st.column_config.TextColumn("BUY/SELL", width=80),
             "signal":      st.column_config.TextColumn("SIGNAL", width=280),
         }
@@ -185,15 +211,14 @@ with col_b:
 st.divider()
 st.markdown("### 🐳 WHALE ALERT FEED")
 
-whales = df[df["score"] >= 3.0].head(20) if not df.empty else pd.DataFrame()
-if whales.empty:
+whales = load_recent(20, hours, min_usd, max(min_score, 3.0))
+if not whales:
     st.info("No high-score trades yet.")
 else:
-    for _, row in whales.iterrows():
+    for row in whales:
         emoji = "🐳" if row["score"] >= 5 else "🦈"
-        ts    = row["timestamp"].strftime("%H:%M:%S")
         st.markdown(
-            f"`{ts}` {emoji} **{row['market_name'][:50]}** — "
+            f"`{hms(row['timestamp'])}` {emoji} **{row['market_name'][:50]}** — "
             f"`{row['outcome']}` @ **{row['price']:.3f}** — "
             f"**${row['usd_value']:,.0f}** — _{row['alert']}_"
         )
@@ -203,9 +228,9 @@ st.divider()
 st.markdown("### 🎯 Tracked Markets")
 markets_df = load_markets()
 if not markets_df.empty:
-    markets_df["volume_24h"] = markets_df["volume_24h"].apply(lambda x: f"${x:,.0f}")
     st.dataframe(markets_df[["name", "volume_24h", "last_seen"]],
-                 use_container_width=True, hide_index=True)
+                 use_container_width=True, hide_index=True,
+                 column_config={"volume_24h": st.column_config.NumberColumn(format="$%,.0f")})
 
 # ─── Auto Refresh ─────────────────────────────────────────────────────────────
 if auto_refresh: